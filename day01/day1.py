@@ -2,9 +2,14 @@
 Get story at : https://adventofcode.com/2023/day/1
 """
 
+import mmap
+import os
+from concurrent.futures import ProcessPoolExecutor
 from enum import Enum
 from pathlib import Path
-from typing import List, Tuple
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
 
 sample = """1abc2
 pqr3stu8vwx
@@ -53,34 +58,91 @@ def get_numbers_from_line(line: str) -> Tuple[int, int]:
     return left, right
 
 
+class DigitsMatcher:
+    """
+    Aho-Corasick automaton recognizing several patterns in a single pass over a text.
+
+    Each pattern is associated to a value (the digit it stands for).
+    The automaton is built once, then each scan costs one dictionary lookup per character.
+    """
+
+    def __init__(self, patterns: Dict[str, int]):
+        # transitions[state] gives the next state for each character of the patterns alphabet,
+        # any other character brings back to the root state (0)
+        self.transitions: List[Dict[str, int]] = [{}]
+        # longest pattern (length, value) ending at this state, following the failure links
+        self.outputs: List[Optional[Tuple[int, int]]] = [None]
+        self.max_len = max(len(p) for p in patterns)
+
+        # build the trie
+        for pattern, value in patterns.items():
+            state = 0
+            for c in pattern:
+                if c not in self.transitions[state]:
+                    self.transitions.append({})
+                    self.outputs.append(None)
+                    self.transitions[state][c] = len(self.transitions) - 1
+                state = self.transitions[state][c]
+            self.outputs[state] = (len(pattern), value)
+
+        # compute the failure links breadth first, and turn the trie into a full automaton
+        alphabet = {c for p in patterns for c in p}
+        fail = [0] * len(self.transitions)
+        queue = list(self.transitions[0].values())
+        for state in queue:
+            if self.outputs[state] is None:
+                self.outputs[state] = self.outputs[fail[state]]
+            for c in alphabet:
+                if c in self.transitions[state]:
+                    child = self.transitions[state][c]
+                    fail[child] = self.transitions[fail[state]].get(c, 0)
+                    queue.append(child)
+                else:
+                    self.transitions[state][c] = self.transitions[fail[state]].get(c, 0)
+
+    def first_match(self, text: Iterable[str]) -> int:
+        """
+        Scan the text and return the value of the pattern starting the earliest, or -1 if none.
+
+        The scan stops as soon as no pattern can start before the best match already found.
+        """
+        state = 0
+        best_start = -1
+        best_value = -1
+        for i, c in enumerate(text):
+            if best_start != -1 and i >= best_start + self.max_len:
+                break
+            state = self.transitions[state].get(c, 0)
+            found = self.outputs[state]
+            if found is not None:
+                start = i - found[0] + 1
+                if best_start == -1 or start < best_start:
+                    best_start = start
+                    best_value = found[1]
+        return best_value
+
+
+# patterns are the spelled digits and the ascii digits
+DIGITS_PATTERNS = {d.name: d.value for d in Digits} | {str(i): i for i in range(10)}
+# one automaton to search from the left, another one with reversed patterns to search from the right
+FORWARD_MATCHER = DigitsMatcher(DIGITS_PATTERNS)
+BACKWARD_MATCHER = DigitsMatcher({p[::-1]: v for p, v in DIGITS_PATTERNS.items()})
+
+
 def get_str_digits_from_line(line: str) -> Tuple[int, int]:
     """
     gets the first and last digit of each line,
     even if the digit is written as letters
 
+    The first digit is searched from the left of the line, and the last one
+    from the right of the line, so only the ends of the line are read.
+
     For example:
     :param line: `zoneight234`
     :return: 1 (one) and 4
     """
-    left = -1
-    right = -1
-    for i, c in enumerate(line):
-        for d in Digits:
-            if line[i:].startswith(d.name):
-                if left == -1:
-                    left = d.value
-                    right = d.value
-                    break
-                else:
-                    right = d.value
-                    break
-        else:
-            if c.isdigit():
-                if left == -1:
-                    left = int(c)
-                    right = int(c)
-                else:
-                    right = int(c)
+    left = FORWARD_MATCHER.first_match(line)
+    right = BACKWARD_MATCHER.first_match(reversed(line))
     return left, right
 
 
@@ -103,6 +165,110 @@ def calculate_sum(calibration_document: List[str], fn: callable = get_numbers_fr
     return total_sum
 
 
+def iter_chunks(path: Path, chunk_size: int) -> Iterator[Tuple[int, int]]:
+    """
+    Split the file into chunks of about `chunk_size` bytes.
+    Each chunk is extended up to the next newline, so no line is cut in two.
+
+    :param path: the calibration document
+    :param chunk_size: the minimal size of a chunk in bytes
+    :return: the (start, end) offsets of each chunk, end excluded
+    """
+    size = path.stat().st_size
+    if size == 0:
+        return
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        start = 0
+        while start < size:
+            end = min(start + chunk_size, size)
+            if end < size:
+                nl = mm.find(b"\n", end - 1)
+                end = size if nl == -1 else nl + 1
+            yield start, end
+            start = end
+
+
+def sum_chunk(path: Path, start: int, end: int, fn: Callable[[str], Tuple[int, int]]) -> int:
+    """
+    Compute the sum of the calibration values of the lines between `start` and `end`.
+    Only one line at a time is decoded from the memory-mapped file.
+    """
+    total_sum = 0
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        pos = start
+        while pos < end:
+            nl = mm.find(b"\n", pos, end)
+            if nl == -1:
+                nl = end
+            line = mm[pos:nl].rstrip(b"\r").decode()
+            calibration_value = fn(line)
+            total_sum += calibration_value[0] * 10 + calibration_value[1]
+            pos = nl + 1
+    return total_sum
+
+
+def calculate_sum_from_file(path: Path, fn: Callable[[str], Tuple[int, int]] = get_numbers_from_line,
+                            workers: Optional[int] = None, chunk_size: int = 16 * 1024 * 1024) -> int:
+    """
+    Same as `calculate_sum` but streaming the document from the disk.
+
+    The file is memory-mapped and split in chunks aligned on newlines,
+    each chunk is summed in a separate process.
+    The memory used stays the same whatever the size of the document.
+
+    :param path: the calibration document
+    :param fn: the function to extract the 1st and last digit depending if running for part1 or part2
+    :param workers: number of processes, defaults to the number of CPUs
+    :param chunk_size: approximate size of the chunks in bytes
+    :return: the sum, result of the puzzle
+    """
+    chunks = list(iter_chunks(path, chunk_size))
+    if len(chunks) <= 1 or workers == 1:
+        return sum(sum_chunk(path, start, end, fn) for start, end in chunks)
+    workers = min(workers or os.cpu_count() or 1, len(chunks))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        starts, ends = zip(*chunks)
+        n = len(chunks)
+        return sum(executor.map(sum_chunk, [path] * n, starts, ends, [fn] * n))
+
+
+def calculate_sum_vectorized(path: Path) -> int:
+    """
+    Same as `calculate_sum` for part 1, but working on the raw bytes of the whole document with numpy.
+
+    - the positions of all the digits are computed at once with a mask
+    - for each line, the first digit is the first digit position after the start of the line,
+      and the last digit is the last digit position before the end of the line,
+      both found with a binary search in the digit positions
+
+    :param path: the calibration document
+    :return: the sum, result of the puzzle
+    """
+    buffer = np.fromfile(path, dtype=np.uint8)
+    if buffer.size == 0:
+        return 0
+    if buffer[-1] != ord("\n"):
+        buffer = np.append(buffer, np.uint8(ord("\n")))
+
+    ends = np.flatnonzero(buffer == ord("\n"))
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    digits = np.flatnonzero((buffer >= ord("0")) & (buffer <= ord("9")))
+    values = buffer[digits].astype(np.int64) - ord("0")
+    # sentinel digit after the end of the buffer, used for the lines without digit
+    # they get -1 like with `get_numbers_from_line`
+    none = digits.size
+    digits = np.append(digits, buffer.size)
+    values = np.append(values, -1)
+
+    first = np.searchsorted(digits, starts, side="left")
+    first[digits[first] >= ends] = none
+    last = np.searchsorted(digits, ends, side="left") - 1
+    last[last < 0] = none
+    last[digits[last] < starts] = none
+
+    return int((values[first] * 10 + values[last]).sum())
+
+
 def part1():
     sample = Path("day1-part1.txt").read_text()
     print(f"Result of part 1 is {calculate_sum(sample.splitlines())}")
@@ -118,3 +284,7 @@ if __name__ == '__main__':
     part1()
     print(f"Result of the sample for part2 is {calculate_sum(sample2.splitlines(), fn=get_str_digits_from_line)}")
     part2()
+    print(f"Result of part 1 vectorized is {calculate_sum_vectorized(Path('day1-part1.txt'))}")
+    print(f"Result of part 1 streamed is {calculate_sum_from_file(Path('day1-part1.txt'), chunk_size=4096)}")
+    print(f"Result of part 2 streamed is "
+          f"{calculate_sum_from_file(Path('day1-part1.txt'), fn=get_str_digits_from_line, chunk_size=4096)}")
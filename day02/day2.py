@@ -1,8 +1,14 @@
 """
 Get story at : https://adventofcode.com/2023/day/2
 """
-from dataclasses import dataclass
+import json
+from array import array
+from dataclasses import dataclass, field
+from math import prod
 from pathlib import Path
+from typing import Dict, List, Tuple
+
+import numpy as np
 
 sample = """Game 1: 3 blue, 4 red; 1 red, 2 green, 6 blue; 2 green
 Game 2: 1 blue, 2 green; 3 green, 4 blue, 1 red; 1 green, 1 blue
@@ -11,6 +17,9 @@ Game 4: 1 green, 3 red, 6 blue; 3 green, 6 red; 3 green, 15 blue, 14 red
 Game 5: 6 red, 1 blue, 3 green; 2 blue, 1 red, 2 green
 """
 
+# The bag of the puzzle, used to check if a game is possible
+BAG = {"red": 12, "green": 13, "blue": 14}
+
 
 @dataclass
 class Cubes:
@@ -49,12 +58,12 @@ class Cubes:
         self.blue = max(self.blue, b)
         self.green = max(self.green, g)
 
-    def is_possible(self):
+    def is_possible(self, bag: Dict[str, int] = BAG):
         """
         The Elf would first like to know which games would have been possible if the bag contained only
         12 red cubes, 13 green cubes, and 14 blue cubes?
         """
-        return self.red <= 12 and self.green <= 13 and self.blue <= 14
+        return self.red <= bag["red"] and self.green <= bag["green"] and self.blue <= bag["blue"]
 
     def power(self) -> int:
         """
@@ -74,54 +83,217 @@ class Cubes:
         return self.red * self.green * self.blue
 
 
-def part1(input_str: str):
+def parse_game(line: str) -> Tuple[int, Dict[str, int]]:
+    """
+    Parse a game like:
+    Game 1: 3 blue, 4 red; 1 red, 2 green, 6 blue; 2 green
+    and return its id and the maximum number of cubes drawn for each color.
+    """
+    game, rounds = line.split(":")
+    _, g_num = game.strip().split(" ")
+    maxima: Dict[str, int] = {}
+    for round_ in rounds.split(";"):
+        for c in round_.split(","):
+            n, color = c.strip().split(" ")
+            maxima[color] = max(maxima.get(color, 0), int(n))
+    return int(g_num), maxima
+
+
+@dataclass
+class GameStore:
+    """
+    All the games of the log, stored in columns:
+    - the game ids
+    - for each color, the maximum number of cubes drawn in each game
+
+    The log is parsed once, and both parts are computed from the columns.
+    The colors are not hard-coded, they are discovered while parsing.
+    """
+    ids: array = field(default_factory=lambda: array("q"))
+    colors: Dict[str, array] = field(default_factory=dict)
+
+    @classmethod
+    def parse(cls, input_str: str) -> "GameStore":
+        store = cls()
+        for line in input_str.splitlines():
+            store.add_game(line)
+        return store
+
+    def add_game(self, line: str):
+        """
+        Parse a game and append its id and the maximum of each color to the columns.
+        """
+        g_num, maxima = parse_game(line)
+        for color in maxima:
+            if color not in self.colors:
+                # a new color, the previous games had none of them
+                self.colors[color] = array("q", bytes(8 * len(self.ids)))
+        self.ids.append(g_num)
+        for color, column in self.colors.items():
+            column.append(maxima.get(color, 0))
+
+    def column(self, color: str) -> np.ndarray:
+        """The maximum of cubes of this color for each game, zeros for an unknown color"""
+        if color not in self.colors:
+            return np.zeros(len(self.ids), dtype=np.int64)
+        return np.frombuffer(self.colors[color], dtype=np.int64)
+
+    def possible_sum(self, bag: Dict[str, int]) -> int:
+        """
+        Sum of the ids of the games possible with this bag.
+        A color missing from the bag means there is no cube of that color in the bag.
+        """
+        possible = np.ones(len(self.ids), dtype=bool)
+        for color in self.colors:
+            possible &= self.column(color) <= bag.get(color, 0)
+        return int(np.frombuffer(self.ids, dtype=np.int64)[possible].sum())
+
+    def power_sum(self) -> int:
+        """
+        Sum of the power of all games, like `Cubes.power` a missing color counts as 1.
+        The red, green and blue colors are always part of the power.
+        """
+        power = np.ones(len(self.ids), dtype=np.int64)
+        for color in set(self.colors) | set(BAG):
+            power *= np.maximum(self.column(color), 1)
+        return int(power.sum())
+
+
+@dataclass
+class BagIndex:
+    """
+    Answers "what is the sum of the ids of the games possible with this bag?" for many bags.
+
+    For each color, the distinct maxima of the games are sorted on an axis.
+    A table with one dimension per color holds the sum of the ids of the games at each point,
+    then it is accumulated along every axis: each cell holds the sum of the ids of all the games
+    dominated by that point.
+    A query is then a binary search on each axis followed by a single lookup in the table.
+
+    The table has one cell per combination of distinct maxima, its size is checked
+    against `max_cells` before it is allocated.
+    """
+    colors: Tuple[str, ...]
+    axes: List[np.ndarray]
+    table: np.ndarray
+
+    @classmethod
+    def from_store(cls, games: GameStore, max_cells: int = 16 * 1024 * 1024) -> "BagIndex":
+        """
+        :param games: the games to index
+        :param max_cells: the maximum number of cells of the table (8 bytes each)
+        :raise ValueError: when the games have too many distinct maxima for the table
+        """
+        colors = tuple(games.colors)
+        columns = [games.column(color) for color in colors]
+        axes = [np.unique(column) for column in columns]
+        cells = prod(axis.size for axis in axes)
+        if cells > max_cells:
+            shape = " x ".join(f"{axis.size} {color}" for color, axis in zip(colors, axes))
+            raise ValueError(f"The bag index would need {cells} cells ({shape}), more than {max_cells}")
+        coordinates = tuple(np.searchsorted(axis, column) for axis, column in zip(axes, columns))
+        table = np.zeros(tuple(axis.size for axis in axes), dtype=np.int64)
+        if colors:
+            np.add.at(table, coordinates, np.frombuffer(games.ids, dtype=np.int64))
+        for dimension in range(table.ndim):
+            np.cumsum(table, axis=dimension, out=table)
+        return cls(colors, axes, table)
+
+    def possible_sums(self, bags: List[Dict[str, int]]) -> np.ndarray:
+        """
+        Sum of the ids of the games possible with each of the bags.
+        A color missing from a bag means there is no cube of that color in the bag.
+        """
+        if not self.colors:
+            return np.zeros(len(bags), dtype=np.int64)
+        found = np.ones(len(bags), dtype=bool)
+        coordinates = []
+        for color, axis in zip(self.colors, self.axes):
+            limits = np.array([bag.get(color, 0) for bag in bags], dtype=np.int64)
+            # last distinct maximum lower or equal to the limit, -1 if all games have more cubes
+            coordinate = np.searchsorted(axis, limits, side="right") - 1
+            found &= coordinate >= 0
+            coordinates.append(np.maximum(coordinate, 0))
+        return np.where(found, self.table[tuple(coordinates)], 0)
+
+    def possible_sum(self, bag: Dict[str, int]) -> int:
+        """Sum of the ids of the games possible with this bag"""
+        return int(self.possible_sums([bag])[0])
+
+
+@dataclass
+class IncrementalGames:
+    """
+    Running totals of both parts for a game log that only grows.
+
+    The offset of the end of the last game read is kept, so a refresh
+    only reads and parses the games appended since the previous one.
+    The state can be saved to a file, to continue after a restart.
+    """
+    path: Path
+    bag: Dict[str, int] = field(default_factory=lambda: dict(BAG))
+    offset: int = 0
+    possible_sum: int = 0
+    power_sum: int = 0
+
+    def refresh(self) -> Tuple[int, int]:
+        """
+        Read the new complete lines of the log and update the totals.
+        A last line without its newline is still being written, it is left for the next refresh.
+        :return: the possible games sum and the power sum
+        """
+        with open(self.path, "rb") as f:
+            f.seek(self.offset)
+            for raw_line in f:
+                if not raw_line.endswith(b"\n"):
+                    break
+                self.offset += len(raw_line)
+                line = raw_line.decode().strip()
+                if not line:
+                    continue
+                g_num, maxima = parse_game(line)
+                if all(n <= self.bag.get(color, 0) for color, n in maxima.items()):
+                    self.possible_sum += g_num
+                power = 1
+                for color in set(maxima) | set(BAG):
+                    power *= max(maxima.get(color, 0), 1)
+                self.power_sum += power
+        return self.possible_sum, self.power_sum
+
+    def save(self, state_path: Path):
+        state = {"offset": self.offset, "possible_sum": self.possible_sum, "power_sum": self.power_sum,
+                 "bag": self.bag}
+        state_path.write_text(json.dumps(state))
+
+    @classmethod
+    def load(cls, path: Path, state_path: Path) -> "IncrementalGames":
+        """Restore the totals of the log, or start from its beginning if there is no saved state"""
+        if not state_path.exists():
+            return cls(path)
+        state = json.loads(state_path.read_text())
+        return cls(path, state["bag"], state["offset"], state["possible_sum"], state["power_sum"])
+
+
+def part1(games: GameStore):
     """
     Solve part 1 of the puzzle.
-    - reading each line
-    - parsing the game number
-    - parsing the rounds
-    - checking if the game is possible
+    - checking which games are possible with the bag
     - summing up all the games that are possible
     """
-    sum_ = 0
-    for line in input_str.splitlines():
-        game, line = line.split(":")
-        _, g_num = game.strip().split(" ")
-        g_num = int(g_num)
-        cubes = Cubes()
-        for round_ in line.split(";"):
-            cubes.add_round(round_)
-        if cubes.is_possible():
-            # print(f"Game {g_num} is possible")
-            sum_ += g_num
-        else:
-            # print(f"Game {g_num} is not possible")
-            pass
-    print(f"Solution of part #1 is {sum_}")
-
-
-def part2(input_str: str):
+    print(f"Solution of part #1 is {games.possible_sum(BAG)}")
+
+
+def part2(games: GameStore):
     """
     Solve part 2 of the puzzle.
-    - reading each line
-    - parsing the game number
-    - parsing the rounds
     - computing the power of the cubes
     - summing up all powers
     """
-    sum_ = 0
-    for line in input_str.splitlines():
-        game, line = line.split(":")
-        cubes = Cubes()
-        for round_ in line.split(";"):
-            cubes.add_round(round_)
-        # print(cubes)
-        power = cubes.power()
-        sum_ += power
-    print(f"Solution of part #2 is {sum_}")
+    print(f"Solution of part #2 is {games.power_sum()}")
 
 
 if __name__ == '__main__':
     sample = Path("part1.txt").read_text()
-    part1(sample)
-    part2(sample)
\ No newline at end of file
+    games = GameStore.parse(sample)
+    part1(games)
+    part2(games)
@@ -1,9 +1,15 @@
 """
 Get story at : https://adventofcode.com/2023/day/3
 """
-from dataclasses import dataclass
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from math import isqrt
 from pathlib import Path
-from typing import List, Iterator, Self
+from typing import Deque, Dict, Iterable, List, Iterator, Optional, Self, Tuple, Type
+
+import numpy as np
 
 sample = """467..114..
 ...*......
@@ -79,8 +85,35 @@ class EngineBluePrint:
     """
     This class represents the blueprint as described in the problem.
     It contains a list of part numbers and symbols.
+
+    The grid maps each cell of the blueprint to the part number or symbol occupying it,
+    so the neighbors of an item are found by looking at the cells around it.
     """
     values: List[PartNumber]
+    grid: Dict[Tuple[int, int], PartNumber] = field(default_factory=dict, repr=False)
+
+    @classmethod
+    def from_lines(cls, lines: List[str]) -> Self:
+        """
+        Parse the lines of the blueprint and remove the isolated part numbers.
+        """
+        engine = cls(values=[])
+        for i, l in enumerate(lines):
+            pns = list(PartNumber.from_line(l, i))
+            engine.values.extend(pns)
+        engine.build_index()
+        engine.remove_isolated_num_from_symbol()
+        return engine
+
+    def build_index(self):
+        """
+        Fill the grid with the cells occupied by each part number and symbol.
+        Must be called once all the values are parsed.
+        """
+        self.grid = {}
+        for pn in self.values:
+            for x in range(pn.x, pn.x + pn.l):
+                self.grid[(x, pn.y)] = pn
 
     def remove_isolated_num_from_symbol(self):
         """
@@ -111,37 +144,35 @@ class EngineBluePrint:
     def has_symbol_neighbors(self, pn: PartNumber) -> bool:
         """
         Checks if a given PartNumber object has any neighboring symbols.
-        It iterates over a collection of n values and checks if the x and y coordinates of n fall within a range
-        defined by start_x, end_x, start_y, and end_y.
+        It looks at the cells around the part number, diagonals included.
         If a neighboring symbol is found, it returns True.
         If no neighboring symbols are found, it returns False.
         """
-        # keep diagonals
-        start_x = pn.x - 1
-        end_x = pn.x + pn.l
-        start_y = pn.y - 1
-        end_y = pn.y + 1
-        for n in self.values:
-            if n.value >= 0:
-                # We are not interested in numbers, only symbols
-                continue
-            if start_x <= n.x <= end_x:
-                if start_y <= n.y <= end_y:
+        if not self.grid:
+            self.build_index()
+        for y in (pn.y - 1, pn.y, pn.y + 1):
+            for x in range(pn.x - 1, pn.x + pn.l + 1):
+                n = self.grid.get((x, y))
+                if n is not None and n.value < 0:
                     # print(f"{pn} has neighbor {n}")
                     return True
         return False
 
     def get_neighbor_values(self, n: PartNumber) -> List[PartNumber]:
         """
-        Returns a list of part symbols that are neighbors of the given part number.
+        Returns a list of part numbers that are neighbors of the given symbol.
+        A part number spanning several cells around the symbol is returned only once.
         """
+        if not self.grid:
+            self.build_index()
         result = []
-        for pn in self.values:
-            if pn.value <= 0:
-                # We are not interested in symbols
-                continue
-            if pn.y - 1 <= n.y <= pn.y + 1:
-                if pn.x - 1 <= n.x <= pn.x + pn.l:
+        for y in (n.y - 1, n.y, n.y + 1):
+            for x in (n.x - 1, n.x, n.x + 1):
+                pn = self.grid.get((x, y))
+                if pn is None or pn.value <= 0:
+                    # We are not interested in symbols
+                    continue
+                if not any(pn is other for other in result):
                     result.append(pn)
         return result
 
@@ -152,7 +183,7 @@ class EngineBluePrint:
         """
         return sum(map(lambda x: x.value if x.value >= 0 else 0, self.values))
 
-    def print_with_blanks(self) -> str:
+    def print_with_blanks(self, width: Optional[int] = None) -> str:
         """
         This is a debugging function that prints the blueprint after parsing it.
 
@@ -162,14 +193,18 @@ class EngineBluePrint:
         With this visualization and diff tool, I was able to spot the problem.
 
         The code is a bit messy, I let the reader improve it, and post a PR if needed.
+
+        :param width: the width of the blueprint, defaults to the end of the rightmost value
         """
+        if width is None:
+            width = max((pn.x + pn.l for pn in self.values), default=0)
         y = 0
         result = ""
         s = ""
         for pn in self.values:
             if pn.y > y:
-                if len(s) < 140:
-                    s += '.' * (140 - len(s))
+                if len(s) < width:
+                    s += '.' * (width - len(s))
                 result += s
                 result += '\n'
                 y = pn.y
@@ -184,8 +219,8 @@ class EngineBluePrint:
                 # fill_blank = 'X'
                 s += fill_blank * pn.l
 
-        if len(s) < 140:
-            s += '.' * (140 - len(s))
+        if len(s) < width:
+            s += '.' * (width - len(s))
         result += s
         result += '\n'
         return result
@@ -207,7 +242,228 @@ class EngineBluePrint:
         return gear_ratios
 
 
-def parse(lines: List[str]):
+@dataclass
+class ArrayBluePrint:
+    """
+    Another representation of the blueprint, as a 2D array of characters, solved with numpy.
+
+    The fields are:
+        grid: the characters of the blueprint
+        labels: for each cell, the number of the digit run occupying it (starting at 1), 0 if not a digit
+        numbers: the value of each digit run, indexed by its label (index 0 is unused)
+        symbols: True for each cell occupied by a symbol
+
+    The numbers are int64, so a number of more than `MAX_DIGITS` digits is refused,
+    and the sums and products that could overflow are computed with Python integers.
+    """
+    MAX_DIGITS = 18
+
+    grid: np.ndarray
+    labels: np.ndarray
+    numbers: np.ndarray
+    symbols: np.ndarray
+
+    @classmethod
+    def from_lines(cls, lines: List[str]) -> Self:
+        width = max((len(line) for line in lines), default=0)
+        data = "".join(line.ljust(width, ".") for line in lines).encode()
+        grid = np.frombuffer(data, dtype=np.uint8).reshape(len(lines), width)
+        digits = (grid >= ord("0")) & (grid <= ord("9"))
+        symbols = ~digits & (grid != ord("."))
+
+        # a digit run starts on a digit without a digit on its left, and ends on a digit without a digit on its right
+        starts = digits.copy()
+        starts[:, 1:] &= ~digits[:, :-1]
+        ends = digits.copy()
+        ends[:, :-1] &= ~digits[:, 1:]
+        labels = np.where(digits, np.cumsum(starts.ravel()).reshape(grid.shape), 0)
+
+        # each digit weights 10 to the power of its distance to the end of its run
+        cells = np.flatnonzero(digits)
+        cell_labels = labels.ravel()[cells]
+        power = np.flatnonzero(ends)[cell_labels - 1] - cells
+        if power.max(initial=0) >= cls.MAX_DIGITS:
+            raise ValueError(f"A number has more than {cls.MAX_DIGITS} digits, use EngineBluePrint")
+        numbers = np.zeros(int(starts.sum()) + 1, dtype=np.int64)
+        np.add.at(numbers, cell_labels, (grid.ravel()[cells].astype(np.int64) - ord("0")) * 10 ** power)
+        return cls(grid, labels, numbers, symbols)
+
+    def neighborhoods(self, mask: np.ndarray) -> np.ndarray:
+        """
+        Returns the labels of the 3x3 neighborhood (the cell itself included) of each True cell of the mask.
+        :return: an array of shape (cells, 9)
+        """
+        padded = np.pad(self.labels, 1)
+        ys, xs = np.nonzero(mask)
+        return np.stack([padded[ys + 1 + dy, xs + 1 + dx] for dy in (-1, 0, 1) for dx in (-1, 0, 1)], axis=1)
+
+    def part_sum(self) -> int:
+        """
+        Returns the sum of all the part numbers.
+        The symbols are dilated to their 3x3 neighborhood, any digit run touching them is a part number.
+        """
+        padded = np.pad(self.symbols, 1)
+        height, width = self.symbols.shape
+        near = np.zeros_like(self.symbols)
+        for dy in (0, 1, 2):
+            for dx in (0, 1, 2):
+                near |= padded[dy:dy + height, dx:dx + width]
+        is_part = np.zeros(self.numbers.size, dtype=bool)
+        is_part[self.labels[near & (self.labels > 0)]] = True
+        parts = self.numbers[is_part]
+        if parts.size and int(parts.max()) > np.iinfo(np.int64).max // parts.size:
+            # the sum could overflow
+            return sum(parts.tolist())
+        return int(parts.sum())
+
+    def get_gears_ratio(self) -> List[int]:
+        """
+        Returns the gear ratios of the engine, in the same order as `EngineBluePrint.get_gears_ratio`.
+
+        The gear ratio is the product of the two neighboring part numbers separated by a symbol.
+        """
+        around = self.neighborhoods(self.symbols)
+        # like `EngineBluePrint.get_neighbor_values`, a part number of value 0 is ignored
+        around[self.numbers[around] <= 0] = 0
+        around.sort(axis=1)
+        distinct = around != 0
+        distinct[:, 1:] &= around[:, 1:] != around[:, :-1]
+        factors = np.where(distinct, self.numbers[around], 1)
+        if int(self.numbers.max(initial=0)) > isqrt(np.iinfo(np.int64).max):
+            # the products could overflow
+            factors = factors.astype(object)
+        ratios = factors.prod(axis=1)
+        return ratios[distinct.sum(axis=1) == 2].tolist()
+
+
+@dataclass
+class BluePrintRow:
+    """
+    One row of the blueprint, with its cells indexed by column.
+
+    The fields are:
+        symbols: the symbols of the row, by column
+        cells: the part number occupying each column of the row
+        numbers: the part numbers of the row
+    """
+    symbols: Dict[int, PartNumber]
+    cells: Dict[int, PartNumber]
+    numbers: List[PartNumber]
+
+    @classmethod
+    def from_line(cls, line: str, num_line: int) -> Self:
+        row = cls({}, {}, [])
+        for pn in PartNumber.from_line(line, num_line):
+            if pn.value < 0:
+                row.symbols[pn.x] = pn
+            else:
+                row.numbers.append(pn)
+                for x in range(pn.x, pn.x + pn.l):
+                    row.cells[x] = pn
+        return row
+
+
+def stream_blueprint(lines: Iterable[str]) -> Iterator[Tuple[int, int]]:
+    """
+    Solve both parts reading the blueprint one line at a time.
+
+    A number or a symbol only has neighbors in the row above and in the row below,
+    so only three rows are kept: when a row is read, the row before it has all its neighbors
+    and its contributions are computed before it is forgotten.
+
+    :param lines: the lines of the blueprint, for example an opened file
+    :return: a generator of the sum of the part numbers and the sum of the gear ratios of each row
+    """
+    empty = BluePrintRow({}, {}, [])
+    window: Deque[BluePrintRow] = deque([empty, empty], maxlen=3)
+    num_line = -1
+    for num_line, line in enumerate(lines):
+        window.append(BluePrintRow.from_line(line.rstrip("\r\n"), num_line))
+        if num_line > 0:
+            yield row_contributions(*window)
+    if num_line >= 0:
+        window.append(empty)
+        yield row_contributions(*window)
+
+
+def row_contributions(above: BluePrintRow, row: BluePrintRow, below: BluePrintRow) -> Tuple[int, int]:
+    """
+    Compute the sum of the part numbers and the sum of the gear ratios of the middle row.
+    Only the cells around each number and each symbol are looked at.
+    """
+    rows = (above, row, below)
+    part_sum = 0
+    for pn in row.numbers:
+        if any(x in r.symbols for r in rows for x in range(pn.x - 1, pn.x + pn.l + 1)):
+            part_sum += pn.value
+    gears_sum = 0
+    for symbol in row.symbols.values():
+        neighbors = []
+        for r in rows:
+            for x in (symbol.x - 1, symbol.x, symbol.x + 1):
+                pn = r.cells.get(x)
+                # like `EngineBluePrint.get_neighbor_values`, a part number of value 0 is ignored
+                if pn is not None and pn.value > 0 and not any(pn is other for other in neighbors):
+                    neighbors.append(pn)
+        if len(neighbors) == 2:
+            gears_sum += neighbors[0].value * neighbors[1].value
+    return part_sum, gears_sum
+
+
+def stream_parse(path: Path):
+    """
+    Same as `parse`, but the blueprint is streamed from the file and never fully in memory.
+    """
+    part_sum = 0
+    gears_sum = 0
+    with open(path) as f:
+        for part_contribution, gears_contribution in stream_blueprint(f):
+            part_sum += part_contribution
+            gears_sum += gears_contribution
+    print(f"Solution of part #1 is {part_sum}")
+    print(f"Solution of part #2 is {gears_sum}")
+
+
+def band_contributions(lines: List[str]) -> Tuple[int, int]:
+    """
+    Compute the sum of the part numbers and the sum of the gear ratios of a band of rows.
+
+    The first and the last lines are halo rows: they are only used as neighbors,
+    their own numbers and symbols belong to the bands above and below.
+    """
+    rows = [BluePrintRow.from_line(line, i) for i, line in enumerate(lines)]
+    part_sum = 0
+    gears_sum = 0
+    for i in range(1, len(rows) - 1):
+        part_contribution, gears_contribution = row_contributions(rows[i - 1], rows[i], rows[i + 1])
+        part_sum += part_contribution
+        gears_sum += gears_contribution
+    return part_sum, gears_sum
+
+
+def parallel_parse(lines: List[str], workers: Optional[int] = None, band_height: int = 10_000):
+    """
+    Same as `parse`, but the blueprint is split in horizontal bands solved in parallel processes.
+
+    Each band carries a copy of the row above and of the row below it, so each number and each
+    symbol is counted exactly once, by the band owning its row.
+
+    :param lines: the lines of the blueprint
+    :param workers: number of processes, defaults to the number of CPUs
+    :param band_height: number of rows of each band
+    """
+    padded = [""] + lines + [""]
+    bands = [padded[start:start + band_height + 2] for start in range(0, len(lines), band_height)]
+    if len(bands) <= 1 or workers == 1:
+        results = list(map(band_contributions, bands))
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers or os.cpu_count() or 1, len(bands))) as executor:
+            results = list(executor.map(band_contributions, bands))
+    print(f"Solution of part #1 is {sum(part_sum for part_sum, _ in results)}")
+    print(f"Solution of part #2 is {sum(gears_sum for _, gears_sum in results)}")
+
+
+def parse(lines: List[str], engine_class: Type[EngineBluePrint | ArrayBluePrint] = EngineBluePrint):
     """
     Parse the lines of the blueprint.
         - parse the part numbers
@@ -215,16 +471,16 @@ def parse(lines: List[str]):
         - calculate the sum of the part numbers
 
     :param lines: the lines of the blueprint
+    :param engine_class: the representation of the blueprint used to solve the puzzle
     """
-    engine = EngineBluePrint(values=[])
-    for i, l in enumerate(lines):
-        pns = list(PartNumber.from_line(l, i))
-        engine.values.extend(pns)
-    engine.remove_isolated_num_from_symbol()
+    engine = engine_class.from_lines(lines)
     print(f"Solution of part #1 is {engine.part_sum()}")
     print(f"Solution of part #2 is {sum(engine.get_gears_ratio())}")
 
 
 if __name__ == '__main__':
     sample = Path("part1.txt").read_text()
-    parse(sample.splitlines())
\ No newline at end of file
+    parse(sample.splitlines())
+    parse(sample.splitlines(), engine_class=ArrayBluePrint)
+    stream_parse(Path("part1.txt"))
+    parallel_parse(sample.splitlines(), band_height=16)
\ No newline at end of file
@@ -1,9 +1,12 @@
 """
 Get story at : https://adventofcode.com/2023/day/4
 """
-from dataclasses import dataclass
+from collections import deque
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import List, Any, Self
+from typing import Deque, Iterable, Iterator, List, Any, Self, Sequence, Tuple
+
+import numpy as np
 
 sample = """Card 1: 41 48 83 86 17 | 83 86  6 31 17  9 48 53
 Card 2: 13 32 20 16 61 | 61 30 68 82 17 32 24 19
@@ -13,21 +16,55 @@ Card 5: 87 83 26 28 32 | 88 30 70 12 93 22 82 36
 Card 6: 31 18 13 56 72 | 74 77 10 23 35 67 36 11"""
 
 
-@dataclass
+def to_mask(nums: Iterable[int]) -> int:
+    """
+    Converts a list of numbers into a bitmask: the bit n is set if the number n is in the list.
+    `[1, 3]` gives `0b1010`
+    """
+    mask = 0
+    for n in nums:
+        mask |= 1 << n
+    return mask
+
+
+def from_mask(mask: int) -> List[int]:
+    """
+    Converts a bitmask back into the sorted list of its numbers.
+    """
+    return [n for n in range(mask.bit_length()) if mask >> n & 1]
+
+
+@dataclass(slots=True)
 class Card:
     """
     This represents a scratchcard
 
+    The numbers are small integers, so each side of the card is stored as a bitmask.
+    The matching numbers are then the bits set in both masks.
+
     Fields:
         name: the name of the card (eg. Card 1)
         num: the number of the card (eg. 1)
-        win_nums: the winning numbers (eg. [41, 48, 83, 86, 17])
-        my_nums: the numbers that have been drawn (eg. [83, 86, 6, 31, 17, 9, 48, 53])
+        win_mask: the winning numbers (eg. [41, 48, 83, 86, 17]) as a bitmask
+        my_mask: the numbers that have been drawn (eg. [83, 86, 6, 31, 17, 9, 48, 53]) as a bitmask
+        num_wins: how many winning numbers have been drawn, computed once at creation
     """
     name: str
     num: int
-    win_nums: List[int]
-    my_nums: List[int]
+    win_mask: int
+    my_mask: int
+    num_wins: int = field(init=False)
+
+    def __post_init__(self):
+        self.num_wins = (self.win_mask & self.my_mask).bit_count()
+
+    @property
+    def win_nums(self) -> List[int]:
+        return from_mask(self.win_mask)
+
+    @property
+    def my_nums(self) -> List[int]:
+        return from_mask(self.my_mask)
 
     def compute_points(self) -> int:
         """
@@ -52,7 +89,7 @@ class Card:
          where `**` operator is the power operator
 
         """
-        count = self.compute_num_wins()
+        count = self.num_wins
         if count == 0:
             return 0
         else:
@@ -62,11 +99,7 @@ class Card:
         """
         Counts how many times the winning numbers appear in the my_nums
         """
-        count = 0
-        for win in self.win_nums:
-            if win in self.my_nums:
-                count += 1
-        return count
+        return self.num_wins
 
     @classmethod
     def from_line(cls, line: str) -> Self:
@@ -89,45 +122,121 @@ class Card:
         _, c_num = card_name.split()
 
         winners, mines = data.strip().split("|")
-        # split on spaces to get the numbers as strings and convert them to int using map, creating a list of ints
-        winners = list(map(int, winners.strip().split()))
-        mines = list(map(int, mines.strip().split()))
+        # split on spaces to get the numbers as strings and convert them to int using map, creating a bitmask
+        winners = to_mask(map(int, winners.split()))
+        mines = to_mask(map(int, mines.split()))
 
         return cls(card_name, int(c_num), winners, mines)
 
 
-def duplicate_x_cards(deck: List[Card], num: int, count: int):
+def count_cards(cards: List[Card]) -> int:
+    """
+    Count the cards of the deck at the end of the game, original cards and copies.
+
+    :param cards: the initial deck of cards
+    :return: the number of cards at the end, original cards included
+    """
+    return count_copies([card.num_wins for card in cards])
+
+
+def count_copies(num_wins: Sequence[int]) -> int:
+    """
+    Count the cards of the deck at the end of the game from the number of wins of each card.
+
+    Instead of playing the game with every copy, we only keep how many copies of each card we have.
+    A card only wins copies of the cards after it, so when we reach a card, its number of copies is final:
+    each of its copies wins one copy of each of the next `num_wins` cards.
+    """
+    copies = [1] * len(num_wins)
+    for i, wins in enumerate(num_wins):
+        for j in range(i + 1, min(i + 1 + wins, len(num_wins))):
+            copies[j] += copies[i]
+    return sum(copies)
+
+
+def stream_cards(lines: Iterable[str]) -> Iterator[Tuple[int, int]]:
     """
-    Duplicate cards in a range of x cards
-    :param deck: the deck of cards
-    :param num: the starting card number (excluded from the duplication)
-    :param count: the number of cards to duplicate after that
-    :return: the list of duplicated cards
+    Play the game reading the cards one at a time, without keeping the deck.
+
+    Copies only go to the next `num_wins` cards, so we only keep the copies won for the
+    next cards, in a ring buffer as long as the highest number of wins seen so far.
+
+    :param lines: the lines of the cards, for example an opened file
+    :return: a generator of the running totals after each card: part 1 points and part 2 count of cards
     """
-    dupli = []
-    for i in range(count):
-        dupli.append(deck[num + i])
-    return dupli
+    pending: Deque[int] = deque()
+    points = 0
+    total = 0
+    for line in lines:
+        if not line.strip():
+            continue
+        card = Card.from_line(line)
+        copies = 1 + (pending.popleft() if pending else 0)
+        while len(pending) < card.num_wins:
+            pending.append(0)
+        for i in range(card.num_wins):
+            pending[i] += copies
+        points += card.compute_points()
+        total += copies
+        yield points, total
 
 
-def play_game(cards: List[Card]) -> List[Card]:
+@dataclass
+class Deck:
     """
-    Play a game of bingo, hum, advent of code.
+    The whole deck of scratchcards, loaded at once in numpy matrices.
+
+    Fields:
+        nums: the number of each card
+        win_nums: the winning numbers, one row per card
+        my_nums: the numbers that have been drawn, one row per card
 
-    This is a recursive function that will play the game until there are no more cards that can win.
-    :param cards: the initial deck of cards for this round
-    :return: the card won in this round
+    All the cards must have the same count of winning numbers and of drawn numbers.
     """
-    won_cards = []
-    for card in cards:
-        num_wins = card.compute_num_wins()
-        if num_wins > 0:
-            won_cards.extend(duplicate_x_cards(new_deck, card.num, num_wins))
+    nums: np.ndarray
+    win_nums: np.ndarray
+    my_nums: np.ndarray
 
-    if len(won_cards) == 0:
-        return []
-    won_cards.extend(play_game(won_cards))
-    return won_cards
+    @classmethod
+    def from_lines(cls, lines: List[str]) -> Self:
+        """
+        Creates the deck from lines like `Card 1: 41 48 83 86 17 | 83 86  6 31 17  9 48 53`
+
+        All the numbers of the deck are converted in a single call, then reshaped into a matrix.
+        """
+        if not lines:
+            empty = np.zeros((0, 0), dtype=np.int64)
+            return cls(np.zeros(0, dtype=np.int64), empty, empty)
+        width = len(lines[0].split(":")[1].split("|")[0].split())
+        # drop the word `Card`, each row holds the card number, the winning numbers then the drawn numbers
+        text = " ".join(line.split(maxsplit=1)[1].replace(":", " ").replace("|", " ") for line in lines)
+        table = np.array(text.split(), dtype=np.int64).reshape(len(lines), -1)
+        return cls(table[:, 0], table[:, 1:1 + width], table[:, 1 + width:])
+
+    def compute_num_wins(self) -> np.ndarray:
+        """
+        Counts how many winning numbers have been drawn, for each card.
+        The drawn numbers are marked in a presence matrix (one column per possible number),
+        then the winning numbers are looked up in it.
+        """
+        rows = np.arange(self.nums.size)[:, None]
+        present = np.zeros((self.nums.size, int(self.my_nums.max(initial=0)) + 1), dtype=bool)
+        present[rows, self.my_nums] = True
+        winning = np.minimum(self.win_nums, present.shape[1] - 1)
+        return (present[rows, winning] & (self.win_nums < present.shape[1])).sum(axis=1)
+
+    def compute_points(self) -> np.ndarray:
+        """
+        Compute the points of each card, see `Card.compute_points`
+        """
+        count = self.compute_num_wins()
+        return np.where(count > 0, np.left_shift(1, np.maximum(count - 1, 0)), 0)
+
+    def count_cards(self) -> int:
+        """
+        Count the cards of the deck at the end of the game, see `count_cards`
+        """
+        return count_copies(self.compute_num_wins().tolist())
 
 
 if __name__ == '__main__':
@@ -142,7 +251,16 @@ if __name__ == '__main__':
     print(f"Part 1 solution {sum(map(lambda x: x.compute_points(), cards))}")
 
     # part 2
-    new_deck = [c for c in cards]
-    won_cards = play_game(new_deck)
-    new_deck.extend(won_cards)
-    print(f"Part 2 solution {len(new_deck)}")
\ No newline at end of file
+    print(f"Part 2 solution {count_cards(cards)}")
+
+    # same reading the file one card at a time
+    with open("part1.txt") as f:
+        for points, total in stream_cards(f):
+            pass
+    print(f"Part 1 solution {points}")
+    print(f"Part 2 solution {total}")
+
+    # same with the whole deck at once
+    deck = Deck.from_lines(sample.splitlines())
+    print(f"Part 1 solution {deck.compute_points().sum()}")
+    print(f"Part 2 solution {deck.count_cards()}")
\ No newline at end of file
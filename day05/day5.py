@@ -3,10 +3,21 @@ Get story at : https://adventofcode.com/2023/day/5
 """
 
 import abc
-from dataclasses import dataclass
+import hashlib
+import heapq
+import json
+import os
+import tempfile
+from bisect import bisect_right
+from collections import deque
+from dataclasses import dataclass, field
+from concurrent.futures import ProcessPoolExecutor
+from functools import cached_property
+from itertools import count
 from pathlib import Path
-from typing import List, Tuple, Type, Self, Optional
+from typing import Dict, List, Tuple, Type, Self, Optional
 
+import numpy as np
 from tqdm import tqdm
 
 sample = """seeds: 79 14 55 13
@@ -53,8 +64,21 @@ class Range:
 
 @dataclass
 class Map:
+    """
+    The ranges of the map are indexed on both sides, to find the range of a number with a binary search.
+
+    An index holds the sorted edges of the ranges, and for each edge the position of the range
+    starting there (-1 for none). Between two edges, the numbers are all in the same range.
+    When ranges overlap, the first one in the list wins.
+
+    When `hits` is set (see `count_hits`), each lookup of a destination counts which range it went through,
+    the last counter is for the numbers outside all the ranges.
+    """
     name: str
     ranges: List[Range]
+    src_index: Optional[Tuple[List[int], List[int]]] = field(default=None, repr=False, compare=False)
+    dst_index: Optional[Tuple[List[int], List[int]]] = field(default=None, repr=False, compare=False)
+    hits: Optional[List[int]] = field(default=None, repr=False, compare=False)
 
     @classmethod
     def from_lines(cls, map_name: str, lines: List[str]) -> Self:
@@ -64,19 +88,119 @@ class Map:
             ranges.append(Range(dst_start, src_start, length))
         return cls(map_name, ranges)
 
+    def build_index(self, starts: List[int]) -> Tuple[List[int], List[int]]:
+        """
+        Index the ranges starting at `starts` (one for each range, in the order of the ranges).
+        """
+        edges = sorted(set(starts) | {start + r.length for start, r in zip(starts, self.ranges)})
+        # sweep the edges in order, with a heap of the ranges containing the current edge:
+        # the range on top is the first one in the list, ranges already ended are removed lazily
+        by_start = sorted(range(len(starts)), key=lambda i: starts[i])
+        active: List[Tuple[int, int]] = []
+        owners = []
+        k = 0
+        for edge in edges:
+            while k < len(by_start) and starts[by_start[k]] <= edge:
+                i = by_start[k]
+                heapq.heappush(active, (i, starts[i] + self.ranges[i].length))
+                k += 1
+            while active and active[0][1] <= edge:
+                heapq.heappop(active)
+            owners.append(active[0][0] if active else -1)
+        return edges, owners
+
+    def source_index(self) -> Tuple[List[int], List[int]]:
+        if self.src_index is None:
+            self.src_index = self.build_index([r.src_start for r in self.ranges])
+        return self.src_index
+
+    def destination_index(self) -> Tuple[List[int], List[int]]:
+        if self.dst_index is None:
+            self.dst_index = self.build_index([r.dst_start for r in self.ranges])
+        return self.dst_index
+
+    def count_hits(self, enabled: bool = True):
+        """Start counting the hits of each range from zero, or stop counting"""
+        self.hits = [0] * (len(self.ranges) + 1) if enabled else None
+
+    def histogram(self) -> Dict[int, int]:
+        """
+        The number of lookups that went through each range, by position of the range.
+        The numbers outside all the ranges are counted under -1.
+        """
+        if self.hits is None:
+            return {}
+        return {i: n for i, n in enumerate(self.hits[:-1])} | {-1: self.hits[-1]}
+
+    def reorder_by_hits(self):
+        """
+        Sort the ranges by decreasing hits, so the code scanning the ranges in order (like `cut_range`)
+        finds the most used ones first.
+        The ranges must not overlap, otherwise their order changes the result of the lookups.
+        """
+        if self.hits is None:
+            raise ValueError(f"Hits are not counted for map {self.name}")
+        for side in (lambda r: r.src_start, lambda r: r.dst_start):
+            ordered = sorted(self.ranges, key=side)
+            if any(side(a) + a.length > side(b) for a, b in zip(ordered, ordered[1:])):
+                raise ValueError(f"Ranges of map {self.name} overlap, their order cannot change")
+        order = sorted(range(len(self.ranges)), key=lambda i: -self.hits[i])
+        self.ranges = [self.ranges[i] for i in order]
+        self.hits = [self.hits[i] for i in order] + [self.hits[-1]]
+        self.src_index = None
+        self.dst_index = None
+
     def get_destination(self, src: int, trace: Optional[List] = None) -> int:
-        for i, r in enumerate(self.ranges):
-            if r.src_start <= src < r.src_start + r.length:
-                if trace is not None:
-                    trace.append((self.name, src, i, r))
-                    print(f"{self.name} {src=} took road #{i} --> {r}")
-                return r.dst_start + src - r.src_start
+        edges, owners = self.source_index()
+        pos = bisect_right(edges, src) - 1
+        i = owners[pos] if pos >= 0 else -1
+        if self.hits is not None:
+            self.hits[i] += 1
+        if i >= 0:
+            r = self.ranges[i]
+            if trace is not None:
+                trace.append((self.name, src, i, r))
+            return r.dst_start + src - r.src_start
         return src
 
+    def get_destinations(self, srcs: np.ndarray) -> np.ndarray:
+        """
+        Same as `get_destination` for a whole array of numbers at once.
+        """
+        edges, owners = self.source_index()
+        offsets = np.array([self.ranges[i].dst_start - self.ranges[i].src_start if i >= 0 else 0 for i in owners]
+                           + [0], dtype=np.int64)
+        # position -1 takes the trailing 0 offset, for the numbers before the first edge
+        pos = np.searchsorted(np.array(edges, dtype=np.int64), srcs, side="right") - 1
+        if self.hits is not None:
+            # the owner -1 (outside all the ranges) is counted in the last counter
+            owner = np.array(owners + [-1], dtype=np.int64)[pos]
+            counts = np.bincount(np.where(owner >= 0, owner, len(self.ranges)), minlength=len(self.hits))
+            self.hits = [n + int(c) for n, c in zip(self.hits, counts)]
+        return srcs + offsets[pos]
+
+    def source_offsets(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        The destination index as numpy arrays: the edges, and the offset to go back to the source
+        from each edge, with a trailing 0 offset for the numbers before the first edge.
+        """
+        edges, owners = self.destination_index()
+        offsets = np.array([self.ranges[i].src_start - self.ranges[i].dst_start if i >= 0 else 0 for i in owners]
+                           + [0], dtype=np.int64)
+        return np.array(edges, dtype=np.int64), offsets
+
+    def get_sources(self, dests: np.ndarray) -> np.ndarray:
+        """
+        Same as `get_source` for a whole array of numbers at once.
+        """
+        return apply_offsets(dests, *self.source_offsets())
+
     def get_source(self, dest: int) -> int:
-        for r in self.ranges:
-            if r.dst_start <= dest < r.dst_start + r.length:
-                return r.src_start + dest - r.dst_start
+        edges, owners = self.destination_index()
+        pos = bisect_right(edges, dest) - 1
+        if pos >= 0 and owners[pos] >= 0:
+            r = self.ranges[owners[pos]]
+            return r.src_start + dest - r.dst_start
         return dest
 
 
@@ -109,6 +233,18 @@ class Workflow:
     def walk(self, seed: int, trace: Optional[List] = None) -> int:
         ...
 
+    def count_hits(self, enabled: bool = True):
+        """
+        Count the hits of the ranges of every map.
+        Only the lookups done in this process are counted, not the ones of the process pools.
+        """
+        for mp in self.maps:
+            mp.count_hits(enabled)
+
+    def histograms(self) -> Dict[str, Dict[int, int]]:
+        """The histogram of the hits of each map, by map name"""
+        return {mp.name: mp.histogram() for mp in self.maps}
+
     @abc.abstractmethod
     def solve_part1(self, seeds: Seeds) -> int:
         ...
@@ -127,16 +263,26 @@ class NaiveWorkflow(Workflow):
                 m = s
         return m
 
-    def solve_part2(self, seeds: Seeds) -> int:
-        m = 9999999999999999
-        cpt = 0
-        for seed_start, length in seeds.part2_iter():
-            for seed in tqdm(range(seed_start, seed_start + length)):
-                cpt += 1
-                s = self.walk(seed)
-                if s < m:
-                    m = s
-        return m
+    def solve_part2(self, seeds: Seeds, chunk_size: int = 1 << 20, workers: Optional[int] = None) -> int:
+        """
+        Walk every seed of the ranges, by chunks of seeds sent to parallel processes.
+        Each process returns the minimum location of its chunk.
+        """
+        chunks = [(start, min(start + chunk_size, seed_start + length))
+                  for seed_start, length in seeds.part2_iter()
+                  for start in range(seed_start, seed_start + length, chunk_size)]
+        if not chunks:
+            raise ValueError("No seed to walk")
+        if len(chunks) <= 1 or workers == 1:
+            return min(self.chunk_min(start, stop) for start, stop in tqdm(chunks))
+        with ProcessPoolExecutor(max_workers=min(workers or os.cpu_count() or 1, len(chunks))) as executor:
+            starts, stops = zip(*chunks)
+            minimums = executor.map(self.chunk_min, starts, stops)
+            return min(tqdm(minimums, total=len(chunks)))
+
+    def chunk_min(self, start: int, stop: int) -> int:
+        """The minimum location of the seeds from `start` to `stop` (excluded)"""
+        return int(self.walk_batch(np.arange(start, stop, dtype=np.int64)).min())
 
     def walk(self, seed: int, trace: Optional[List] = None) -> int:
         s = seed
@@ -145,23 +291,83 @@ class NaiveWorkflow(Workflow):
             s = d
         return s
 
+    def walk_batch(self, seeds: np.ndarray) -> np.ndarray:
+        """Same as `walk` for a whole array of seeds"""
+        s = seeds
+        for mp in self.maps:
+            s = mp.get_destinations(s)
+        return s
+
 
 class ReverseWorkflow(Workflow):
+    """
+    Walk the locations backwards from 0, until one of them comes from a seed.
+
+    The locations are searched by blocks in parallel processes, each block is walked at once with numpy.
+    The blocks are collected in increasing order: when a block contains a seed, all the blocks before
+    it have been searched, so its lowest location is the answer and the next blocks are cancelled.
+    """
+
     def solve_part1(self, seeds: Seeds) -> int:
-        loc = 0
-        while True:
-            s = self.walk(loc)
-            if s in seeds.seeds:
-                return loc
-            loc += 1
+        return self.search([(seed, 1) for seed in seeds.seeds])
 
     def solve_part2(self, seeds: Seeds) -> int:
-        for loc in tqdm(range(1_000_000, 1_000_000_000)):
-            s = self.walk(loc)
-            for start, length in seeds.part2_iter():
-                if start <= s < start + length:
-                    return loc
-            # loc += 1
+        return self.search(seeds.part2_iter())
+
+    def search(self, seed_ranges: List[Tuple[int, int]], block_size: int = 1 << 20,
+               workers: Optional[int] = None) -> int:
+        """
+        Find the lowest location coming from one of the seed ranges.
+        :param seed_ranges: the seed ranges as (start, length)
+        :param block_size: the number of locations searched by each task
+        :param workers: number of processes, defaults to the number of CPUs
+        """
+        # sorted and merged seed intervals, to check the seeds with a binary search
+        intervals = []
+        for start, length in sorted(r for r in seed_ranges if r[1] > 0):
+            if intervals and start <= intervals[-1][1]:
+                intervals[-1][1] = max(intervals[-1][1], start + length)
+            else:
+                intervals.append([start, start + length])
+        if not intervals:
+            raise ValueError("No seed to search for")
+        seed_starts = np.array([start for start, _ in intervals], dtype=np.int64)
+        seed_ends = np.array([end for _, end in intervals], dtype=np.int64)
+
+        # the maps backwards, sent once to each process
+        steps = [mp.source_offsets() for mp in self.maps.__reversed__()]
+        blocks = count(0, block_size)
+        if workers == 1:
+            init_search(steps, seed_starts, seed_ends)
+            for loc in tqdm(blocks, unit="block"):
+                hit = search_block(loc, loc + block_size)
+                if hit is not None:
+                    return hit
+
+        workers = workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_search,
+                                 initargs=(steps, seed_starts, seed_ends)) as executor:
+            pending = deque()
+            for _ in range(2 * workers):
+                loc = next(blocks)
+                pending.append(executor.submit(search_block, loc, loc + block_size))
+            with tqdm(unit="block") as progress:
+                while True:
+                    hit = pending.popleft().result()
+                    progress.update()
+                    if hit is not None:
+                        for future in pending:
+                            future.cancel()
+                        return hit
+                    loc = next(blocks)
+                    pending.append(executor.submit(search_block, loc, loc + block_size))
+
+    def walk_batch(self, locs: np.ndarray) -> np.ndarray:
+        """Same as `walk` for a whole array of locations"""
+        s = locs
+        for mp in self.maps.__reversed__():
+            s = mp.get_sources(s)
+        return s
 
     def walk(self, loc: int) -> int:
         s = loc
@@ -171,6 +377,136 @@ class ReverseWorkflow(Workflow):
         return s
 
 
+def apply_offsets(numbers: np.ndarray, edges: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    """Move each number by the offset of the last edge before it (the trailing offset if there is none)"""
+    return numbers + offsets[np.searchsorted(edges, numbers, side="right") - 1]
+
+
+# The maps and seeds searched by `search_block` in this process, set by `init_search`
+SEARCH_CONTEXT: Optional[Tuple[List[Tuple[np.ndarray, np.ndarray]], np.ndarray, np.ndarray]] = None
+
+
+def init_search(steps: List[Tuple[np.ndarray, np.ndarray]], seed_starts: np.ndarray, seed_ends: np.ndarray):
+    """
+    Keep what `search_block` needs, so it is sent once to each process instead of with each block.
+    :param steps: the edges and offsets of each map, from the location back to the seed (see `Map.source_offsets`)
+    :param seed_starts: the sorted starts of the seed intervals
+    :param seed_ends: the ends (excluded) of the seed intervals
+    """
+    global SEARCH_CONTEXT
+    SEARCH_CONTEXT = steps, seed_starts, seed_ends
+
+
+def search_block(start: int, stop: int) -> Optional[int]:
+    """
+    The lowest location from `start` to `stop` (excluded) coming from a seed, None if there is none.
+    """
+    steps, seed_starts, seed_ends = SEARCH_CONTEXT
+    locs = np.arange(start, stop, dtype=np.int64)
+    s = locs
+    for edges, offsets in steps:
+        s = apply_offsets(s, edges, offsets)
+    pos = np.searchsorted(seed_starts, s, side="right") - 1
+    hits = np.flatnonzero((pos >= 0) & (s < seed_ends[np.maximum(pos, 0)]))
+    return int(locs[hits[0]]) if hits.size else None
+
+
+@dataclass
+class PiecewiseMap:
+    """
+    A function over the non-negative integers that is a translation on each of its pieces.
+
+    The piece `i` starts at `starts[i]` and goes up to the start of the next piece (excluded),
+    the last piece goes to infinity.
+    A number `x` of the piece `i` goes to `x + offsets[i]`.
+    """
+    starts: List[int]
+    offsets: List[int]
+
+    @classmethod
+    def identity(cls) -> Self:
+        return cls([0], [0])
+
+    @classmethod
+    def from_map(cls, mp: Map) -> Self:
+        """
+        Each edge of the source index of the map starts a piece, like `Map.get_destination`.
+        """
+        edges, owners = mp.source_index()
+        starts, offsets = ([], []) if edges and edges[0] == 0 else ([0], [0])
+        for edge, owner in zip(edges, owners):
+            r = mp.ranges[owner] if owner >= 0 else None
+            starts.append(edge)
+            offsets.append(r.dst_start - r.src_start if r else 0)
+        return cls(starts, offsets).merged()
+
+    def merged(self) -> Self:
+        """Merge the consecutive pieces having the same offset"""
+        starts, offsets = [], []
+        for start, offset in zip(self.starts, self.offsets):
+            if not offsets or offsets[-1] != offset:
+                starts.append(start)
+                offsets.append(offset)
+        return PiecewiseMap(starts, offsets)
+
+    def __call__(self, x: int) -> int:
+        return x + self.offsets[bisect_right(self.starts, x) - 1]
+
+    def then(self, after: Self) -> Self:
+        """
+        Compose the two functions: the numbers go through this one, then through `after`.
+
+        The image of each of our pieces is cut at the edges of the pieces of `after`.
+        """
+        starts, offsets = [], []
+        for i, (start, offset) in enumerate(zip(self.starts, self.offsets)):
+            end = self.starts[i + 1] if i + 1 < len(self.starts) else None
+            j = bisect_right(after.starts, start + offset) - 1
+            while j < len(after.starts) and (end is None or after.starts[j] < end + offset):
+                starts.append(max(start + offset, after.starts[j]) - offset)
+                offsets.append(offset + after.offsets[j])
+                j += 1
+        return PiecewiseMap(starts, offsets).merged()
+
+    def min_image(self, start: int, length: int) -> int:
+        """
+        The lowest number reached by the numbers from `start` to `start + length` (excluded).
+        On each piece the function is increasing, so only the first number of each piece is checked.
+        """
+        end = start + length
+        lowest = None
+        i = bisect_right(self.starts, start) - 1
+        while i < len(self.starts) and self.starts[i] < end:
+            image = max(start, self.starts[i]) + self.offsets[i]
+            if lowest is None or image < lowest:
+                lowest = image
+            i += 1
+        return lowest
+
+
+class IntervalWorkflow(Workflow):
+    """
+    All the maps are composed once into a single piecewise function from seeds to locations,
+    then the seed ranges are sent through it as whole intervals.
+    """
+
+    @cached_property
+    def function(self) -> PiecewiseMap:
+        function = PiecewiseMap.identity()
+        for mp in self.maps:
+            function = function.then(PiecewiseMap.from_map(mp))
+        return function
+
+    def solve_part1(self, seeds: Seeds) -> int:
+        return min(self.walk(seed) for seed in seeds.seeds)
+
+    def solve_part2(self, seeds: Seeds) -> int:
+        return min(self.function.min_image(start, length) for start, length in seeds.part2_iter() if length > 0)
+
+    def walk(self, seed: int, trace: Optional[List] = None) -> int:
+        return self.function(seed)
+
+
 def parse_input(text: str) -> Tuple[Seeds, List[Map]]:
     lines = text.splitlines()
     import re
@@ -201,23 +537,127 @@ def parse_input(text: str) -> Tuple[Seeds, List[Map]]:
     return seeds, result
 
 
+# Version of the compiled almanac files, to change each time their content or the indexes change
+ALMANAC_FORMAT = 1
+
+
+@dataclass
+class CompiledAlmanac:
+    """
+    Everything computed from an almanac before solving: the seeds, the maps with their indexes,
+    and the maps composed into a single function.
+
+    It is saved as JSON in a cache directory, under the hash of the almanac text,
+    so the next runs on the same almanac load it without parsing anything.
+    """
+    seeds: Seeds
+    maps: List[Map]
+    function: PiecewiseMap
+
+    @classmethod
+    def compile(cls, text: str) -> Self:
+        seeds, maps = parse_input(text)
+        for mp in maps:
+            mp.source_index()
+            mp.destination_index()
+        return cls(seeds, maps, IntervalWorkflow(maps).function)
+
+    def workflow(self, wfc: Type[Workflow]) -> Workflow:
+        """Create a workflow on the compiled maps, an `IntervalWorkflow` reuses the composed function"""
+        wf = wfc(self.maps)
+        if isinstance(wf, IntervalWorkflow):
+            wf.function = self.function
+        return wf
+
+    def to_json(self) -> str:
+        return json.dumps({
+            "format": ALMANAC_FORMAT,
+            "seeds": self.seeds.seeds,
+            "maps": [{"name": mp.name,
+                      "ranges": [(r.dst_start, r.src_start, r.length) for r in mp.ranges],
+                      "src_index": mp.source_index(),
+                      "dst_index": mp.destination_index()} for mp in self.maps],
+            "function": (self.function.starts, self.function.offsets),
+        })
+
+    @classmethod
+    def from_json(cls, text: str) -> Self:
+        data = json.loads(text)
+        if data["format"] != ALMANAC_FORMAT:
+            raise ValueError(f"Almanac format {data['format']} is not {ALMANAC_FORMAT}")
+        maps = [Map(mp["name"], [Range(*r) for r in mp["ranges"]],
+                    tuple(mp["src_index"]), tuple(mp["dst_index"])) for mp in data["maps"]]
+        return cls(Seeds(data["seeds"]), maps, PiecewiseMap(*data["function"]))
+
+
+def load_almanac(path: Path, cache_dir: Path = Path(".almanac_cache"), max_bytes: int = 64 * 1024 * 1024
+                 ) -> CompiledAlmanac:
+    """
+    Load the compiled almanac of the file from the cache, or compile and save it.
+
+    The cache file is named after the hash of the almanac and `ALMANAC_FORMAT`, so the almanacs
+    compiled by an older version of the code are never loaded.
+    A cache file that cannot be read is compiled again.
+    The cache directory is kept under `max_bytes`: the least recently used almanacs are removed first.
+    """
+    text = path.read_bytes()
+    cached = cache_dir / f"{hashlib.sha256(text).hexdigest()}-v{ALMANAC_FORMAT}.json"
+    try:
+        almanac = CompiledAlmanac.from_json(cached.read_text())
+        # mark as recently used
+        os.utime(cached)
+        return almanac
+    except (OSError, ValueError, KeyError, TypeError):
+        # missing, being replaced, or broken: compile it again
+        pass
+
+    almanac = CompiledAlmanac.compile(text.decode())
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    # write in a temporary file then rename it, so another run never reads a partial file
+    with tempfile.NamedTemporaryFile("w", dir=cache_dir, suffix=".tmp", delete=False) as f:
+        f.write(almanac.to_json())
+    os.replace(f.name, cached)
+    evict_almanacs(cache_dir, max_bytes)
+    return almanac
+
+
+def evict_almanacs(cache_dir: Path, max_bytes: int):
+    """Remove the least recently used almanacs until the cache directory fits in `max_bytes`"""
+    files = []
+    for f in cache_dir.glob("*.json"):
+        try:
+            stat = f.stat()
+        except FileNotFoundError:
+            # removed by another run
+            continue
+        files.append((stat.st_mtime, stat.st_size, f))
+    files.sort()
+    total = sum(size for _, size, _ in files)
+    # the most recent one is always kept
+    for _, size, f in files[:-1]:
+        if total <= max_bytes:
+            break
+        total -= size
+        f.unlink(missing_ok=True)
+
+
 def part1(wfc: Type[Workflow]):
-    sample = Path("part1.txt").read_text()
-    seeds, maps = parse_input(sample)
-    wf = wfc(maps)
-    m = wf.solve_part1(seeds)
+    almanac = load_almanac(Path("part1.txt"))
+    wf = almanac.workflow(wfc)
+    m = wf.solve_part1(almanac.seeds)
     print(f"Solution of part #1 is location {m}")
 
 
 def part2(wfc: Type[Workflow]):
-    sample = Path("part1.txt").read_text()
-    seeds, maps = parse_input(sample)
-    wf = wfc(maps)
-    m = wf.solve_part2(seeds)
+    almanac = load_almanac(Path("part1.txt"))
+    wf = almanac.workflow(wfc)
+    m = wf.solve_part2(almanac.seeds)
     print(f"Solution of part #2 is location {m}")
 
 
 if __name__ == '__main__':
     part1(NaiveWorkflow)
     # part2(NaiveWorkflow)
-    part2(ReverseWorkflow)
+    # part2(ReverseWorkflow)
+    part1(IntervalWorkflow)
+    part2(IntervalWorkflow)
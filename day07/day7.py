@@ -1,9 +1,12 @@
-from collections import Counter, OrderedDict
+import os
+import tempfile
 from dataclasses import dataclass
 from enum import Enum, auto
-from functools import cmp_to_key
+from operator import attrgetter
 from pathlib import Path
-from typing import List, Dict, Optional
+from typing import List, Optional, Set, Type
+
+import numpy as np
 
 sample = """32T3K 765
 T55J5 684
@@ -22,20 +25,19 @@ class HandPart1:
     hand: str
     bid: int
     rank: Optional["TypedHand"] = None
+    key: int = 0
 
     RANK_ORDER = "AKQJT98765432"
+    JOKERS = False
 
     @classmethod
     def from_line(cls, line: str):
         h, b = line.split()
         return cls(h, int(b))
 
-    def count_same_cards(self) -> Dict[str, int]:
-        c = Counter(self.hand)
-        return c
-
     def assign_rank(self):
         self.rank = TypedHand.from_hand(self)
+        self.key = sort_key(self)
 
 
 @dataclass
@@ -43,34 +45,19 @@ class HandPart2:
     hand: str
     bid: int
     rank: Optional["TypedHand"] = None
+    key: int = 0
 
     RANK_ORDER = "AKQT98765432J"
+    JOKERS = True
 
     @classmethod
     def from_line(cls, line: str):
         h, b = line.split()
         return cls(h, int(b))
 
-    def count_same_cards(self) -> Dict[str, int]:
-        c = Counter(self.hand)
-        if c.keys().__contains__("J"):
-            others = OrderedDict(c)
-            num_jokers = others.pop("J")
-            others = others.items()
-            others = sorted(others, key=lambda x: x[1], reverse=True)
-            try:
-                if num_jokers == 5:
-                    others = [ ('A', 5) ]
-                else:
-                    others[0] = (others[0][0], others[0][1] + num_jokers)
-            except IndexError:
-                print(others)
-            c = dict(others)
-
-        return c
-
     def assign_rank(self):
         self.rank = TypedHand.from_hand(self)
+        self.key = sort_key(self)
 
 
 Hand = HandPart2
@@ -87,87 +74,193 @@ class TypedHand(Enum):
 
     @classmethod
     def from_hand(cls, hand: Hand):
-        cards_and_count = hand.count_same_cards()
-        if len(cards_and_count) == 1:
-            return cls.FIVE_OF_A_KIND
-        if len(cards_and_count) == 2:
-            if any(map(lambda x: x == 4, cards_and_count.values())):
-                return cls.FOUR_OF_A_KIND
-            else:
-                return cls.FULL_HOUSE
-        if len(cards_and_count) == 3:
-            if any(map(lambda x: x == 3, cards_and_count.values())):
-                return cls.THREE_OF_A_KIND
-            else:
-                return cls.TWO_PAIR
-        if len(cards_and_count) == 4:
-            return cls.ONE_PAIR
-        return cls.HIGH_CARD
-
-
-def hand_sorter(hands: List[Hand], comparator) -> List[Hand]:
-    return sorted(hands, key=cmp_to_key(comparator), reverse=False)
-
-
-def parse_input(sample: List[str]) -> List[Hand]:
+        """
+        The type of the hand is read in the table of all the possible hands, see `hand_type_table`.
+        """
+        return cls(int(hand_type_table()[int(hand.JOKERS), encode_hand(hand.hand)]))
+
+
+# Each card is a digit of the hand written in base 13
+CARDS = "AKQJT98765432"
+CARD_CODES = {c: i for i, c in enumerate(CARDS)}
+
+
+def encode_hand(hand: str) -> int:
+    """The number of the hand among the 13^5 possible hands"""
+    code = 0
+    for c in hand:
+        code = code * 13 + CARD_CODES[c]
+    return code
+
+
+# Where to save the table of the hand types between runs, None to always compute it
+HAND_TYPES_CACHE: Optional[Path] = None
+# Version of the saved table, part of the file name, to change each time the table changes
+HAND_TYPES_FORMAT = 1
+# The table of the hand types, once computed or loaded
+HAND_TYPES: Optional[np.ndarray] = None
+# The files known to hold the table
+HAND_TYPES_SAVED: Set[Path] = set()
+
+
+def hand_type_table(cache_path: Optional[Path] = None) -> np.ndarray:
+    """
+    The type of all the 13^5 possible hands, indexed by `encode_hand`:
+    the row 0 with the part 1 rules, the row 1 with the jokers of part 2.
+
+    The table is computed on the first call, then kept for the next ones.
+    It is saved next to `cache_path` (defaults to `HAND_TYPES_CACHE`) if given, with `HAND_TYPES_FORMAT`
+    in the file name, the next runs load it from there.
+    A saved table that cannot be read or has not the expected shape is computed and saved again.
+    """
+    global HAND_TYPES
+    cache_path = cache_path or HAND_TYPES_CACHE
+    if cache_path is not None:
+        cache_path = cache_path.with_name(f"{cache_path.stem}-v{HAND_TYPES_FORMAT}{cache_path.suffix}")
+    if HAND_TYPES is not None and (cache_path is None or cache_path in HAND_TYPES_SAVED):
+        return HAND_TYPES
+
+    saved = None
+    if cache_path is not None:
+        try:
+            saved = np.load(cache_path, allow_pickle=False)
+            if saved.shape != (2, 13 ** 5) or saved.dtype != np.uint8:
+                saved = None
+        except (OSError, ValueError):
+            # missing or broken
+            saved = None
+    if HAND_TYPES is None:
+        HAND_TYPES = saved if saved is not None else build_hand_type_table()
+    if cache_path is not None:
+        if saved is None:
+            # write in a temporary file then rename it, so another run never reads a partial file
+            with tempfile.NamedTemporaryFile("wb", dir=cache_path.parent, suffix=".tmp", delete=False) as f:
+                np.save(f, HAND_TYPES)
+            os.replace(f.name, cache_path)
+        HAND_TYPES_SAVED.add(cache_path)
+    return HAND_TYPES
+
+
+def build_hand_type_table() -> np.ndarray:
+    """Compute the type of all the possible hands with both rules, see `hand_type_table`"""
+    codes = np.arange(13 ** 5)
+    cards = np.stack([codes // 13 ** (4 - i) % 13 for i in range(5)], axis=1)
+    return np.stack([classify(cards, jokers=False), classify(cards, jokers=True)])
+
+
+def classify(cards: np.ndarray, jokers: bool) -> np.ndarray:
+    """
+    The `TypedHand` values of many hands, from the count of each card in each hand.
+    :param cards: the hands as a (hands, 5) matrix of card codes (see `CARD_CODES`)
+    :param jokers: True to use the jokers of part 2
+    """
+    rows = np.arange(cards.shape[0])
+    counts = np.zeros((cards.shape[0], 13), dtype=np.int64)
+    for i in range(cards.shape[1]):
+        counts[rows, cards[:, i]] += 1
+    if not jokers:
+        return hand_types(counts.max(axis=1), (counts > 0).sum(axis=1))
+    # the jokers join the most frequent other card, 5 jokers are a five of a kind
+    num_jokers = counts[:, CARD_CODES["J"]].copy()
+    counts[:, CARD_CODES["J"]] = 0
+    return hand_types(counts.max(axis=1) + num_jokers, np.maximum((counts > 0).sum(axis=1), 1))
+
+
+def hand_types(most_frequent: np.ndarray, distinct: np.ndarray) -> np.ndarray:
+    """
+    The `TypedHand` values from the count of the most frequent card and the number of distinct cards.
+    """
+    return np.select(
+        [most_frequent == 5, most_frequent == 4,
+         (most_frequent == 3) & (distinct == 2), most_frequent == 3,
+         (most_frequent == 2) & (distinct == 3), most_frequent == 2],
+        [TypedHand.FIVE_OF_A_KIND.value, TypedHand.FOUR_OF_A_KIND.value,
+         TypedHand.FULL_HOUSE.value, TypedHand.THREE_OF_A_KIND.value,
+         TypedHand.TWO_PAIR.value, TypedHand.ONE_PAIR.value],
+        TypedHand.HIGH_CARD.value).astype(np.uint8)
+
+
+def sort_key(hand: Hand) -> int:
+    """
+    A single integer to sort the hands: the type of the hand, then the strength of each card in base 13.
+    The strongest card of `RANK_ORDER` is worth 12 and the weakest 0.
+    """
+    key = hand.rank.value
+    for c in hand.hand:
+        key = key * 13 + len(hand.RANK_ORDER) - 1 - hand.RANK_ORDER.index(c)
+    return key
+
+
+def hand_sorter(hands: List[Hand]) -> List[Hand]:
+    return sorted(hands, key=attrgetter("key"))
+
+
+def parse_input(sample: List[str], hand_class: Type[Hand] = Hand) -> List[Hand]:
     hands = []
     for line in sample:
-        hands.append(Hand.from_line(line))
+        hand = hand_class.from_line(line)
+        hand.assign_rank()
+        hands.append(hand)
     return hands
 
 
-def part1(lines: List[str]):
-    def comparator(h1: Hand, h2: Hand) -> int:
-        if h1.rank.value > h2.rank.value:
-            return 1
-        elif h1.rank.value < h2.rank.value:
-            return -1
-        else:
-            for i, c1 in enumerate(h1.hand):
-                c1 = Hand.RANK_ORDER.index(c1)
-                c2 = Hand.RANK_ORDER.index(h2.hand[i])
-                if c1 > c2:
-                    return -1
-                elif c1 < c2:
-                    return 1
-            return 0
-
-    hands = parse_input(lines)
-    for h in hands:
-        h.assign_rank()
-
-    hands = hand_sorter(hands, comparator)
+def total_winnings(hands: List[Hand]) -> int:
+    hands = hand_sorter(hands)
     cpt = 0
     for rank, h in enumerate(hands):
         cpt += (rank+1) * h.bid
-    print(f"Solution of part 1 is {cpt}")
+    return cpt
+
+
+def total_winnings_batch(lines: List[str], hand_class: Type[Hand] = Hand) -> int:
+    """
+    Same as `total_winnings` with numpy, without creating a `Hand` per line.
+
+    - the hands are decoded in a (hands, 5) uint8 matrix of card codes
+    - the type of each hand is read in `hand_type_table` with the code of the hand (see `encode_hand`)
+    - the same key as `sort_key` is computed for all the hands at once, and sorted with a single argsort
+    - the winnings are the dot product of the ranks and the bids
+    """
+    if not lines:
+        return 0
+    tokens = " ".join(lines).split()
+    if len(tokens) != 2 * len(lines):
+        raise ValueError("Each line must hold a hand and a bid")
+    hands = tokens[0::2]
+    if any(length != 5 for length in map(len, hands)):
+        raise ValueError("Each hand must have 5 cards")
+    bids = np.array(tokens[1::2], dtype=np.int64)
+    chars = np.frombuffer("".join(hands).encode("ascii"), dtype=np.uint8).reshape(-1, 5)
+    # 255 marks the characters that are not cards
+    decode = np.full(256, 255, dtype=np.uint8)
+    decode[[ord(c) for c in CARDS]] = np.arange(len(CARDS))
+    cards = decode[chars]
+    if (cards == 255).any():
+        raise ValueError(f"Unknown card, the cards are {CARDS}")
+
+    codes = np.zeros(cards.shape[0], dtype=np.int64)
+    for i in range(5):
+        codes = codes * 13 + cards[:, i]
+    # strength of each card code with the rules of the hand class, the strongest is 12
+    strength = np.array([len(hand_class.RANK_ORDER) - 1 - hand_class.RANK_ORDER.index(c) for c in CARDS],
+                        dtype=np.uint8)
+    keys = hand_type_table()[int(hand_class.JOKERS), codes].astype(np.int64)
+    for i in range(5):
+        keys = keys * 13 + strength[cards[:, i]]
+
+    ranks = np.empty(keys.size, dtype=np.int64)
+    ranks[np.argsort(keys, kind="stable")] = np.arange(1, keys.size + 1)
+    return int(ranks @ bids)
+
+
+def part1(lines: List[str]):
+    hands = parse_input(lines, HandPart1)
+    print(f"Solution of part 1 is {total_winnings(hands)}")
 
 
 def part2(lines: List[str]):
-    def comparator(h1: Hand, h2: Hand) -> int:
-        if h1.rank.value > h2.rank.value:
-            return 1
-        elif h1.rank.value < h2.rank.value:
-            return -1
-        else:
-            for i, c1 in enumerate(h1.hand):
-                c1 = Hand.RANK_ORDER.index(c1)
-                c2 = Hand.RANK_ORDER.index(h2.hand[i])
-                if c1 > c2:
-                    return -1
-                elif c1 < c2:
-                    return 1
-            return 0
-
-    hands = parse_input(lines)
-    for h in hands:
-        h.assign_rank()
-
-    hands = hand_sorter(hands, comparator)
-    cpt = 0
-    for rank, h in enumerate(hands):
-        cpt += (rank+1) * h.bid
-    print(f"Solution of part 2 is {cpt}")
+    hands = parse_input(lines, HandPart2)
+    print(f"Solution of part 2 is {total_winnings(hands)}")
 
 
 if __name__ == '__main__':